@@ -2,12 +2,14 @@ from . import preproc
 from . import scoring
 from . import analysis
 from . import vizu
+from . import similarity
 
 
 from .analysis import evaluate_OR, evaluate_trait_scores, run_full_trait_pipeline
 from .preproc import foldersLoad, cleanDic
 from .scoring import compute_scores, geneScores, NA_filtering
 from .analysis import NaCount
+from .similarity import stackScores, trait_similarity, TraitIndex
 
 __all__ = [
     "foldersLoad",
@@ -22,5 +24,9 @@ __all__ = [
     "vizu"
     "evaluate_OR",
     "evaluate_trait_scores",
-    "run_full_trait_pipeline"
+    "run_full_trait_pipeline",
+    "similarity",
+    "stackScores",
+    "trait_similarity",
+    "TraitIndex"
 ]
\ No newline at end of file
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import spearmanr
+
+from gene_tools.similarity import TraitIndex, stackScores, trait_similarity
+
+
+def random_matrix(seed=0, n_genes=300, n_traits=6, missing=0.0):
+    rng = np.random.default_rng(seed)
+    values = rng.random((n_genes, n_traits))
+    values[:, 1] = values[:, 0] + rng.normal(0, 0.2, n_genes)
+    # Percentile-like scores so that ties are frequent
+    values = np.round(values * 20)
+    genes = [f"ENSG{i:05d}" for i in range(n_genes)]
+    df = pd.DataFrame(values, index=genes, columns=[f"T{j}" for j in range(n_traits)])
+    return df.mask(rng.random(df.shape) < missing)
+
+
+def overlap_spearman(df, a, b):
+    both = df[[a, b]].dropna()
+    return spearmanr(both[a], both[b])[0]
+
+
+def test_spearman_matches_scipy_without_nan():
+    df = random_matrix()
+    sim = trait_similarity(df, block_size=4)["similarity"]
+    expected = spearmanr(df.to_numpy())[0]
+    np.testing.assert_allclose(sim.to_numpy(), expected, atol=1e-12)
+
+
+def test_spearman_matches_scipy_on_overlap():
+    df = random_matrix(missing=0.3)
+    # Structured missingness: T3 only scored on the extreme deciles of T0
+    extreme = (df["T0"] <= 2) | (df["T0"] >= 18)
+    df.loc[~extreme, "T3"] = np.nan
+    sim = trait_similarity(df, method="spearman", block_size=2)["similarity"]
+    for a in df.columns:
+        for b in df.columns:
+            assert sim.loc[a, b] == pytest.approx(overlap_spearman(df, a, b), abs=1e-12)
+
+    global_rank = trait_similarity(df)["similarity"]
+    assert global_rank.loc["T0", "T3"] != pytest.approx(sim.loc["T0", "T3"])
+
+
+def test_jaccard_top_k():
+    df = random_matrix(missing=0.2)
+    sim = trait_similarity(df, method="jaccard", k=30)["similarity"]
+    top = {t: set(df[t].dropna().sort_index(kind="stable").sort_values(kind="stable").index[:30])
+           for t in df.columns}
+    assert sim.loc["T0", "T1"] == pytest.approx(len(top["T0"] & top["T1"]) / len(top["T0"] | top["T1"]))
+
+
+@pytest.mark.parametrize("method", ["spearman", "spearman_global_rank", "jaccard"])
+def test_update_and_remove_match_full_recompute(method):
+    df = random_matrix(missing=0.3)
+    index = TraitIndex(df.drop(columns="T5"), method=method, k=30)
+
+    new = df["T5"].copy()
+    new.loc["ENSG99999"] = 1.0
+    new.loc["ENSA00000"] = 3.0
+    index.update_trait("T5", new)
+    index.update_trait("T2", df["T0"])
+    index.remove_trait("T4")
+
+    full = trait_similarity(index.scores, method=method, k=30)
+    pd.testing.assert_frame_equal(index.similarity, full["similarity"], check_dtype=False)
+    pd.testing.assert_frame_equal(index.counts, full["counts"], check_dtype=False)
+
+
+def test_jaccard_ties_stable_under_new_genes():
+    df = pd.DataFrame({"A": [1, 1, 1, 1], "B": [9, 9, 1, 2]}, index=["g4", "g3", "g2", "g1"])
+    index = TraitIndex(df, method="jaccard", k=2, min_periods=1)
+    index.update_trait("C", pd.Series([1.0, 2.0], index=["g0", "g1"]))
+    full = trait_similarity(index.scores, method="jaccard", k=2, min_periods=1)["similarity"]
+    assert index.similarity.loc["A", "B"] == full.loc["A", "B"]
+
+
+def test_update_uses_score_col():
+    trait_dict = {
+        t: pd.DataFrame({"EnsemblId": [f"g{i}" for i in range(10)],
+                         "Prioscore_min": np.arange(10.0) * (1 if t == "X" else -1)})
+        for t in ["X", "Y"]
+    }
+    index = TraitIndex.from_traits(trait_dict, score_col="Prioscore_min")
+    index.update_trait("Z", trait_dict["X"])
+    assert index.similarity.loc["X", "Z"] == pytest.approx(1.0)
+    assert index.similarity.loc["Y", "Z"] == pytest.approx(-1.0)
+
+
+def test_save_load_roundtrip(tmp_path):
+    df = random_matrix(missing=0.2)
+    index = TraitIndex(df, method="jaccard", k=20, score_col="Prioscore_min")
+    index.save(tmp_path / "index")
+    loaded = TraitIndex.load(tmp_path / "index")
+
+    assert (loaded.method, loaded.k, loaded.score_col) == ("jaccard", 20, "Prioscore_min")
+    pd.testing.assert_frame_equal(loaded.similarity, index.similarity, check_names=False)
+    pd.testing.assert_frame_equal(loaded.counts, index.counts, check_names=False)
+    pd.testing.assert_frame_equal(loaded.nearest("T0"), index.nearest("T0"))
+
+
+def test_save_rejects_non_string_traits(tmp_path):
+    index = TraitIndex(pd.DataFrame({1: [1.0, 2.0, 3.0], 2: [3.0, 2.0, 1.0]}, index=["a", "b", "c"]))
+    with pytest.raises(TypeError):
+        index.save(tmp_path / "index.npz")
+
+
+def test_stack_scores_sorted():
+    trait_dict = {"X": pd.DataFrame({"EnsemblId": ["g2", "g1", "g1"], "Prioscore_mean": [3.0, 2.0, 1.0]})}
+    stacked = stackScores(trait_dict)
+    assert list(stacked.index) == ["g1", "g2"]
+    assert stacked.loc["g1", "X"] == 1.0